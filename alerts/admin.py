@@ -9,6 +9,7 @@ admin.site.register(Dataset)
 @admin.register(Observation)
 class ObservationAdmin(admin.ModelAdmin):
     list_display = ["pk", "gbif_id", "occurrence_id", "source_dataset", "stable_id"]
+    list_select_related = ["source_dataset"]
     readonly_fields = ["stable_id"]
 
 @admin.register(Species)
@@ -2,10 +2,10 @@ import time
 from datetime import timedelta
 
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
 from django.utils import timezone
 
-from alerts.models import Alert, AlertObservation, Observation
+from alerts.models import Alert, AlertObservation
 
 
 class Command(BaseCommand):
@@ -24,89 +24,73 @@ class Command(BaseCommand):
 
         self.stdout.write("Starting alert sync...")
 
-        # Step 1: Clean up AlertObservation for observations that no longer exist
-        self._cleanup_stale_observations()
-
-        # Step 2: Sync each alert
-        alerts = Alert.objects.all()
+        # Step 1: Sync each alert (filters and users are fetched upfront, so they cost no query per alert)
+        alerts = list(Alert.objects.select_related("user").prefetch_related("species", "datasets"))
         total_new = 0
+        total_removed = 0
         total_auto_marked = 0
 
         for alert in alerts:
-            new_count, auto_marked_count = self._sync_alert(alert)
+            new_count, removed_count, auto_marked_count = self._sync_alert(alert)
             total_new += new_count
+            total_removed += removed_count
             total_auto_marked += auto_marked_count
 
+        # Step 2: Update all unseen counts at once
+        Alert.recompute_all_unseen_counts()
+
         elapsed = time.perf_counter() - start_time
         self.stdout.write(
             self.style.SUCCESS(
-                f"Sync complete: {alerts.count()} alerts processed, "
+                f"Sync complete: {len(alerts)} alerts processed, "
                 f"{total_new} new observations added, "
+                f"{total_removed} no longer matching removed, "
                 f"{total_auto_marked} auto-marked as seen "
                 f"in {elapsed:.2f}s"
             )
         )
 
-    def _cleanup_stale_observations(self):
-        """Remove AlertObservation rows for stable_ids no longer in Observation."""
-        self.stdout.write("Cleaning up stale AlertObservation entries...")
-
-        # Get all stable_ids currently in Observation
-        current_stable_ids = set(
-            Observation.objects.values_list("stable_id", flat=True)
-        )
-
-        # Delete AlertObservation entries that reference non-existent observations
-        stale_count, _ = AlertObservation.objects.exclude(
-            stable_id__in=current_stable_ids
-        ).delete()
-
-        if stale_count > 0:
-            self.stdout.write(f"  Removed {stale_count} stale entries")
-
     def _sync_alert(self, alert):
         """
         Sync a single alert:
         1. Find new matching observations and add them as unseen
-        2. Auto-mark old observations as seen
-        3. Update unseen_count
+        2. Remove observations that don't match anymore (gone from Observation, or filters changed)
+        3. Auto-mark old observations as seen
         4. Optionally queue email notification
 
-        Returns (new_count, auto_marked_count)
+        Returns (new_count, removed_count, auto_marked_count)
         """
         with transaction.atomic():
-            # Get stable_ids matching this alert's filters
-            matching_obs = alert.get_matching_observations()
-            matching_data = {
-                row["stable_id"]: row["date"]
-                for row in matching_obs.values("stable_id", "date")
-            }
-            matching_stable_ids = set(matching_data.keys())
-
-            # Get stable_ids already tracked for this alert
-            existing_stable_ids = set(
-                AlertObservation.objects.filter(alert=alert).values_list(
-                    "stable_id", flat=True
-                )
+            # Add matching observations not tracked yet for this alert, in a single statement: already tracked ones
+            # (and duplicate stable_ids in Observation) hit the (alert, stable_id) unique constraint and are left
+            # untouched, keeping their first_seen_in_alert. No stable_id has to be loaded in Python.
+            matching_sql, matching_params = (
+                alert.get_matching_observations().values("stable_id", "date").query.sql_with_params()
             )
-
-            # Find new observations to add
-            new_stable_ids = matching_stable_ids - existing_stable_ids
-
-            # Bulk create AlertObservation for new observations
-            if new_stable_ids:
-                AlertObservation.objects.bulk_create(
-                    [
-                        AlertObservation(
-                            alert=alert,
-                            stable_id=stable_id,
-                            observation_date=matching_data[stable_id],
-                        )
-                        for stable_id in new_stable_ids
-                    ]
+            alert_observation_table = AlertObservation._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {alert_observation_table} (alert_id, stable_id, observation_date, first_seen_in_alert)
+                    SELECT %s, m.stable_id, m.date, %s
+                    FROM ({matching_sql}) m
+                    ON CONFLICT (alert_id, stable_id) DO NOTHING
+                    """,
+                    [alert.pk, timezone.now(), *matching_params],
                 )
-
-            new_count = len(new_stable_ids)
+                new_count = cursor.rowcount
+
+                # Remove tracked observations missing from the matching ones (same set difference, the other way)
+                cursor.execute(
+                    f"""
+                    DELETE FROM {alert_observation_table} ao
+                    WHERE ao.alert_id = %s AND NOT EXISTS (
+                        SELECT 1 FROM ({matching_sql}) m WHERE m.stable_id = ao.stable_id
+                    )
+                    """,
+                    [alert.pk, *matching_params],
+                )
+                removed_count = cursor.rowcount
 
             # Auto-mark old observations as seen (delete them)
             auto_marked_count = 0
@@ -118,22 +102,18 @@ class Command(BaseCommand):
                     alert=alert, observation_date__lt=cutoff_date
                 ).delete()
 
-            # Update unseen count
-            alert.unseen_count = AlertObservation.objects.filter(alert=alert).count()
-            alert.save(update_fields=["unseen_count"])
-
             # Handle email notification
             if self.send_emails and new_count > 0 and alert.should_send_email():
                 self._send_email_notification(alert, new_count)
 
-        if new_count > 0 or auto_marked_count > 0:
+        if new_count > 0 or removed_count > 0 or auto_marked_count > 0:
             self.stdout.write(
                 f"  Alert '{alert.name}': +{new_count} new, "
-                f"-{auto_marked_count} auto-marked, "
-                f"{alert.unseen_count} unseen total"
+                f"-{removed_count} no longer matching, "
+                f"-{auto_marked_count} auto-marked"
             )
 
-        return new_count, auto_marked_count
+        return new_count, removed_count, auto_marked_count
 
     def _send_email_notification(self, alert, new_count):
         """Send email notification for an alert (placeholder for now)."""
@@ -141,13 +121,16 @@ class Command(BaseCommand):
         # This would include:
         # - Alert details (name, filters)
         # - Count of new observations
-        # - Sample of new observations (join with Observation for details)
         # - Link to alert on website
 
         self.stdout.write(
             f"  [EMAIL] Would send email to {alert.user.email or alert.user.username}: "
             f"{new_count} new observations in '{alert.name}'"
         )
+        for obs in alert.get_new_observations_sample():
+            self.stdout.write(
+                f"    - {obs.date} {obs.species.scientific_name} {obs.locality} (GBIF {obs.gbif_id})"
+            )
 
         alert.last_email_sent_at = timezone.now()
         alert.save(update_fields=["last_email_sent_at"])
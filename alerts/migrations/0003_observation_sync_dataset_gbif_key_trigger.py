@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# Keeps Observation.source_dataset_gbif_key in sync with the source dataset, for every kind of write (save(),
+# bulk_create(), raw SQL, ...). Stored generated columns (stable_id) are computed after BEFORE triggers, so they see
+# the synced value.
+CREATE_TRIGGER_SQL = """
+CREATE FUNCTION alerts_observation_sync_dataset_gbif_key() RETURNS trigger AS $$
+BEGIN
+    NEW.source_dataset_gbif_key := (SELECT gbif_dataset_key FROM alerts_dataset WHERE id = NEW.source_dataset_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER alerts_observation_sync_dataset_gbif_key
+BEFORE INSERT OR UPDATE OF source_dataset_id, source_dataset_gbif_key ON alerts_observation
+FOR EACH ROW EXECUTE FUNCTION alerts_observation_sync_dataset_gbif_key();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER alerts_observation_sync_dataset_gbif_key ON alerts_observation;
+DROP FUNCTION alerts_observation_sync_dataset_gbif_key();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0002_alert_alertobservation'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER_SQL, reverse_sql=DROP_TRIGGER_SQL),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# Observation.source_dataset_gbif_key is a denormalized copy of Dataset.gbif_dataset_key: forbid changing the latter
+# rather than cascading the update. Enforced in the database so it also covers queryset update() and bulk_update().
+# The dedicated SQLSTATE (models.DATASET_KEY_CHANGE_SQLSTATE) lets Dataset.save() recognize the error.
+CREATE_TRIGGER_SQL = """
+CREATE FUNCTION alerts_dataset_prevent_gbif_key_change() RETURNS trigger AS $$
+BEGIN
+    IF NEW.gbif_dataset_key IS DISTINCT FROM OLD.gbif_dataset_key THEN
+        RAISE EXCEPTION 'gbif_dataset_key cannot be changed after creation' USING ERRCODE = 'GBA01';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER alerts_dataset_prevent_gbif_key_change
+BEFORE UPDATE OF gbif_dataset_key ON alerts_dataset
+FOR EACH ROW EXECUTE FUNCTION alerts_dataset_prevent_gbif_key_change();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER alerts_dataset_prevent_gbif_key_change ON alerts_dataset;
+DROP FUNCTION alerts_dataset_prevent_gbif_key_change();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0003_observation_sync_dataset_gbif_key_trigger'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER_SQL, reverse_sql=DROP_TRIGGER_SQL),
+    ]
@@ -0,0 +1,20 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0004_dataset_gbif_key_immutable_trigger'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='observation',
+            name='alerts_obse_stable__9080e1_idx',
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=django.contrib.postgres.indexes.HashIndex(fields=['stable_id'], name='obs_stable_id_hash'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0005_observation_stable_id_hash_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='alertobservation',
+            name='alerts_aler_alert_i_e11978_idx',
+        ),
+        migrations.AddIndex(
+            model_name='alertobservation',
+            index=models.Index(fields=['alert', '-first_seen_in_alert'], include=['stable_id', 'observation_date'], name='alertobs_alert_seen_desc'),
+        ),
+    ]
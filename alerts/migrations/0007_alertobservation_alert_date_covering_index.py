@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0006_alertobservation_alert_seen_desc_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='alertobservation',
+            name='alerts_aler_alert_i_1af387_idx',
+        ),
+        migrations.AddIndex(
+            model_name='alertobservation',
+            index=models.Index(fields=['alert', 'observation_date'], include=['stable_id'], name='ao_alert_date_inc'),
+        ),
+    ]
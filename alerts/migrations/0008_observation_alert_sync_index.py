@@ -0,0 +1,21 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0007_alertobservation_alert_date_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['species', 'source_dataset', '-date'], include=['stable_id'], name='obs_alert_sync_idx'),
+        ),
+        migrations.AlterField(
+            model_name='observation',
+            name='species',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='alerts.species'),
+        ),
+    ]
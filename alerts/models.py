@@ -1,11 +1,16 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import AbstractUser
 from django.contrib.gis.db import models
-from django.db.models import Value
-from django.db.models.functions import Concat
+from django.contrib.postgres.indexes import HashIndex
+from django.db import DatabaseError, connection, router, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Value
+from django.db.models.functions import Coalesce, Concat
 from django.db.models.expressions import Func
 from django.utils import timezone
 
 DATA_SRID = 3857  # Let's keep everything in Google Mercator to avoid reprojections
+DATASET_KEY_CHANGE_SQLSTATE = "GBA01"  # Raised by the trigger of migration 0004
 
 class CustomUser(AbstractUser):
     pass
@@ -18,12 +23,16 @@ class Dataset(models.Model):
         return f"Dataset {self.name} ({self.gbif_dataset_key})"
 
     def save(self, *args, **kwargs):
-        # Prevent changing gbif_dataset_key after creation (to avoid having to cascade updates to Observation.source_dataset_gbif_key)
-        if self.pk is not None:
-            old = Dataset.objects.filter(pk=self.pk).values_list("gbif_dataset_key", flat=True).first()
-            if old != self.gbif_dataset_key:
-                raise ValueError("gbif_dataset_key cannot be changed after creation")
-        super().save(*args, **kwargs)
+        # Changing gbif_dataset_key after creation is prevented by a database trigger (see migration 0004, to avoid
+        # having to cascade updates to Observation.source_dataset_gbif_key). Surface it as a ValueError. The savepoint
+        # absorbs the failed UPDATE, so the surrounding transaction remains usable.
+        try:
+            with transaction.atomic(using=kwargs.get("using") or router.db_for_write(Dataset, instance=self)):
+                super().save(*args, **kwargs)
+        except DatabaseError as e:
+            if getattr(e.__cause__, "pgcode", None) == DATASET_KEY_CHANGE_SQLSTATE:
+                raise ValueError("gbif_dataset_key cannot be changed after creation") from e
+            raise
 
 
 class Species(models.Model):
@@ -49,7 +58,8 @@ class Observation(models.Model):
 
     # Denormalized copy of source_dataset.gbif_dataset_key. This redundancy is intentional:
     # PostgreSQL generated columns cannot reference other tables, so we need this value locally
-    # to compute stable_id at the database level. Automatically synced via save().
+    # to compute stable_id at the database level. Kept in sync by a database trigger (see migration 0003), so it's
+    # also set on bulk_create() and raw SQL inserts.
     source_dataset_gbif_key = models.CharField(max_length=255, editable=False)
 
     # A stable identifier for this observation, computed as MD5(source_dataset_gbif_key | occurrence_id).
@@ -70,7 +80,8 @@ class Observation(models.Model):
         db_persist=True,
     )
 
-    species = models.ForeignKey(Species, on_delete=models.CASCADE)
+    # Not indexed on its own: obs_alert_sync_idx (see Meta) starts with it
+    species = models.ForeignKey(Species, on_delete=models.CASCADE, db_index=False)
     location = models.PointField(blank=True, null=True, srid=DATA_SRID)
     date = models.DateField()
     individual_count = models.IntegerField(blank=True, null=True)
@@ -83,18 +94,18 @@ class Observation(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=["stable_id"]),
+            # stable_id is only ever used for equality lookups (from AlertObservation), and MD5-based values have no
+            # useful order: a hash index is smaller than a B-tree on random UUIDs
+            HashIndex(fields=["stable_id"], name="obs_stable_id_hash"),
+            # Alert matching filters on species and dataset and reads stable_id and date: index-only scans
+            models.Index(
+                fields=["species", "source_dataset", "-date"], include=["stable_id"], name="obs_alert_sync_idx"
+            ),
         ]
 
     def __str__(self):
         return f"Observation {self.gbif_id} ({self.stable_id})"
 
-    def save(self, *args, **kwargs):
-        # Ensure denormalized source_dataset_gbif_key is up to date.
-        # Beware: this won't be called on bulk_create/bulk_update!
-        self.source_dataset_gbif_key = self.source_dataset.gbif_dataset_key
-        super().save(*args, **kwargs)
-
 
 class Alert(models.Model):
     """
@@ -108,6 +119,13 @@ class Alert(models.Model):
         WEEKLY = "weekly", "Weekly"
         MONTHLY = "monthly", "Monthly"
 
+    # Minimum time between two emails, per frequency
+    EMAIL_FREQUENCY_DELTAS = {
+        EmailFrequency.DAILY: timedelta(days=1),
+        EmailFrequency.WEEKLY: timedelta(days=7),
+        EmailFrequency.MONTHLY: timedelta(days=30),
+    }
+
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
 
@@ -135,36 +153,77 @@ class Alert(models.Model):
         return f"Alert '{self.name}' ({self.user.username})"
 
     def get_matching_observations(self):
-        """Get Observation queryset matching this alert's filters (AND logic)."""
-        qs = Observation.objects.all()
+        """Get Observation queryset matching this alert's filters (AND logic).
 
-        if self.species.exists():
-            qs = qs.filter(species__in=self.species.all())
-
-        if self.datasets.exists():
-            qs = qs.filter(source_dataset__in=self.datasets.all())
+        Reads the filters from the prefetch cache when species and datasets are prefetched (no query at all),
+        otherwise lets PostgreSQL resolve them as part of the observations query.
+        """
+        qs = Observation.objects.all()
 
-        # Later: spatial filter
+        if self._is_prefetched("species"):
+            species_ids = [species.pk for species in self.species.all()]
+            if species_ids:
+                qs = qs.filter(species_id__in=species_ids)
+        else:
+            qs = qs.filter(self._get_m2m_filter(Alert.species.through, "species", "species_id"))
+
+        if self._is_prefetched("datasets"):
+            dataset_ids = [dataset.pk for dataset in self.datasets.all()]
+            if dataset_ids:
+                qs = qs.filter(source_dataset_id__in=dataset_ids)
+        else:
+            qs = qs.filter(self._get_m2m_filter(Alert.datasets.through, "dataset", "source_dataset_id"))
+
+        # Later: spatial filter. Stick to predicates the GiST index on location can serve (__intersects, __dwithin,
+        # ...), not computed distances.
         # if self.areas.exists():
         #     qs = qs.filter(location__intersects=self.combined_area)
 
         return qs
 
+    def has_matching_observations(self):
+        """Check if at least one observation matches this alert's filters (stops at the first one, unlike count())."""
+        return self.get_matching_observations().exists()
+
+    @classmethod
+    def recompute_all_unseen_counts(cls):
+        """Update unseen_count of every alert from AlertObservation, in a single statement."""
+        alert_table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {alert_table} a
+                SET unseen_count = COALESCE(c.unseen_count, 0)
+                FROM {alert_table} a2
+                LEFT JOIN (
+                    SELECT alert_id, count(*) AS unseen_count
+                    FROM {AlertObservation._meta.db_table}
+                    GROUP BY alert_id
+                ) c ON c.alert_id = a2.id
+                WHERE a2.id = a.id AND a.unseen_count <> COALESCE(c.unseen_count, 0)
+                """
+            )
+
+    def _is_prefetched(self, field_name):
+        return field_name in getattr(self, "_prefetched_objects_cache", {})
+
+    def _get_m2m_filter(self, through, target_field, observation_field):
+        """Filter matching the targets selected in an M2M table of this alert, or anything if there is none.
+
+        Correlated EXISTS subqueries, served by the (alert_id, target_id) unique index of the M2M table.
+        """
+        alert_rows = through.objects.filter(alert_id=self.pk)
+        return Exists(alert_rows.filter(**{target_field: OuterRef(observation_field)})) | ~Exists(alert_rows)
+
     def should_send_email(self):
         """Check if enough time has passed since last email based on frequency."""
-        from datetime import timedelta
-
         if self.email_frequency == self.EmailFrequency.NEVER:
             return False
 
         if self.last_email_sent_at is None:
             return True
 
-        delta = {
-            "daily": timedelta(days=1),
-            "weekly": timedelta(days=7),
-            "monthly": timedelta(days=30),
-        }[self.email_frequency]
+        delta = self.EMAIL_FREQUENCY_DELTAS[self.email_frequency]
 
         return timezone.now() - self.last_email_sent_at >= delta
 
@@ -173,6 +232,26 @@ class Alert(models.Model):
         since = self.last_email_sent_at or self.created_at
         return self.alertobservation_set.filter(first_seen_in_alert__gt=since)
 
+    @classmethod
+    def with_recent_new_observations(cls, limit=50):
+        """Get Alert queryset with the (up to limit) most recent AlertObservation entries added since last email
+        prefetched in recent_new_observations: two queries whatever the number of alerts."""
+        since = Coalesce("alert__last_email_sent_at", "alert__created_at")
+        recent_new = AlertObservation.objects.filter(first_seen_in_alert__gt=since).order_by("-first_seen_in_alert")
+        return cls.objects.prefetch_related(
+            Prefetch("alertobservation_set", queryset=recent_new[:limit], to_attr="recent_new_observations")
+        )
+
+    def get_new_observations_sample(self, limit=20):
+        """Get the most recent Observations added since last email, with their species, in a single query."""
+        new_stable_ids = self.get_new_observations_since_last_email().values("stable_id")
+        return (
+            Observation.objects.filter(stable_id__in=new_stable_ids)
+            .select_related("species")
+            .only("gbif_id", "date", "locality", "species__scientific_name")
+            .order_by("-date")[:limit]
+        )
+
 
 class AlertObservation(models.Model):
     """
@@ -180,10 +259,11 @@ class AlertObservation(models.Model):
 
     - Created when a new observation matches the alert's filters
     - Deleted when user marks it as seen (manual or auto after X days)
-    - Deleted when observation disappears from Observation table
+    - Deleted when observation disappears from Observation table, or no longer matches the alert's filters
 
     Note: stable_id is NOT a ForeignKey to Observation because Observation
-    is truncated/reloaded nightly. We use stable_id (UUID) to match records.
+    rows are deleted and reinserted by every import (changed rows, or all of
+    them on a full refresh). We use stable_id (UUID) to match records.
     """
 
     alert = models.ForeignKey(Alert, on_delete=models.CASCADE)
@@ -201,8 +281,14 @@ class AlertObservation(models.Model):
             )
         ]
         indexes = [
-            models.Index(fields=["alert", "observation_date"]),
-            models.Index(fields=["alert", "first_seen_in_alert"]),
+            # Covering: auto-mark-as-seen finds the rows to delete from the index only
+            models.Index(fields=["alert", "observation_date"], include=["stable_id"], name="ao_alert_date_inc"),
+            # Covering: the stable_ids added since the last email are read from the index only
+            models.Index(
+                fields=["alert", "-first_seen_in_alert"],
+                include=["stable_id", "observation_date"],
+                name="alertobs_alert_seen_desc",
+            ),
             models.Index(fields=["stable_id"]),
         ]
 
@@ -204,6 +204,47 @@ class TestAlertFiltering:
 
         assert matching.count() == 2
 
+    def test_has_matching_observations(self, alert, species, species2, dataset):
+        Observation.objects.create(
+            gbif_id="1", occurrence_id="occ-1", source_dataset=dataset, species=species, date=date(2024, 1, 15)
+        )
+
+        alert.species.add(species2)
+        assert not alert.has_matching_observations()
+
+        alert.species.add(species)
+        assert alert.has_matching_observations()
+
+    def test_get_matching_observations_uses_prefetched_filters(
+        self, alert, species, dataset, django_assert_num_queries
+    ):
+        alert.species.add(species)
+        alert.datasets.add(dataset)
+        alert = Alert.objects.prefetch_related("species", "datasets").get(pk=alert.pk)
+
+        with django_assert_num_queries(0):
+            sql = str(alert.get_matching_observations().query)
+
+        # Prefetched primary keys are inlined, the M2M tables aren't queried again
+        assert f'"species_id" IN ({species.pk})' in sql
+        assert f'"source_dataset_id" IN ({dataset.pk})' in sql
+        assert "alerts_alert_species" not in sql
+        assert "alerts_alert_datasets" not in sql
+
+    def test_get_matching_observations_single_query_without_prefetch(
+        self, alert, species, species2, dataset, django_assert_num_queries
+    ):
+        Observation.objects.create(
+            gbif_id="1", occurrence_id="occ-1", source_dataset=dataset, species=species, date=date(2024, 1, 15)
+        )
+        Observation.objects.create(
+            gbif_id="2", occurrence_id="occ-2", source_dataset=dataset, species=species2, date=date(2024, 1, 15)
+        )
+        alert.species.add(species)
+
+        with django_assert_num_queries(1):
+            assert alert.get_matching_observations().count() == 1
+
 
 @pytest.mark.django_db
 class TestAlertEmailLogic:
@@ -271,6 +312,41 @@ class TestAlertEmailLogic:
 
         assert new_obs.count() == 1
 
+    def test_with_recent_new_observations(self, user, species, dataset, django_assert_num_queries):
+        obs = Observation.objects.create(
+            gbif_id="1", occurrence_id="occ-1", source_dataset=dataset, species=species, date=date(2024, 1, 15)
+        )
+        emailed_alert = Alert.objects.create(user=user, name="Emailed", last_email_sent_at=timezone.now())
+        new_alert = Alert.objects.create(user=user, name="New")
+        for alert in (emailed_alert, new_alert):
+            AlertObservation.objects.create(alert=alert, stable_id=obs.stable_id, observation_date=obs.date)
+        Alert.objects.filter(pk=emailed_alert.pk).update(last_email_sent_at=timezone.now())
+
+        with django_assert_num_queries(2):
+            alerts = {alert.name: alert for alert in Alert.with_recent_new_observations()}
+            assert alerts["Emailed"].recent_new_observations == []
+            assert [ao.stable_id for ao in alerts["New"].recent_new_observations] == [obs.stable_id]
+
+    def test_get_new_observations_sample(self, alert, species, dataset):
+        for i, obs_date in enumerate([date(2024, 1, 10), date(2024, 1, 20), date(2024, 1, 15)]):
+            obs = Observation.objects.create(
+                gbif_id=str(i),
+                occurrence_id=f"occ-{i}",
+                source_dataset=dataset,
+                species=species,
+                date=obs_date,
+            )
+            AlertObservation.objects.create(alert=alert, stable_id=obs.stable_id, observation_date=obs.date)
+        # Not tracked by the alert
+        Observation.objects.create(
+            gbif_id="other", occurrence_id="occ-other", source_dataset=dataset, species=species, date=date(2024, 2, 1)
+        )
+
+        sample = list(alert.get_new_observations_sample(limit=2))
+
+        assert [obs.date for obs in sample] == [date(2024, 1, 20), date(2024, 1, 15)]
+        assert sample[0].species.scientific_name == "Vespa velutina"
+
 
 @pytest.mark.django_db
 class TestAlertObservationModel:
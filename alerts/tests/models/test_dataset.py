@@ -1,5 +1,7 @@
 import pytest
-from alerts.models import Dataset
+from django.db import DatabaseError
+
+from alerts.models import DATASET_KEY_CHANGE_SQLSTATE, Dataset
 
 
 @pytest.mark.django_db
@@ -9,3 +11,23 @@ def test_dataset_gbif_key_immutable():
     dataset.gbif_dataset_key = "changed"
     with pytest.raises(ValueError, match="cannot be changed"):
         dataset.save()
+
+
+@pytest.mark.django_db
+def test_dataset_gbif_key_change_leaves_transaction_usable():
+    dataset = Dataset.objects.create(name="Test Dataset", gbif_dataset_key="abc-123")
+    dataset.gbif_dataset_key = "changed"
+    with pytest.raises(ValueError):
+        dataset.save()
+
+    Dataset.objects.filter(pk=dataset.pk).update(name="Renamed")
+    assert Dataset.objects.get(pk=dataset.pk).gbif_dataset_key == "abc-123"
+
+
+@pytest.mark.django_db
+def test_dataset_gbif_key_immutable_on_queryset_update():
+    """The check is done in the database, so it also applies to update() and bulk_update()"""
+    dataset = Dataset.objects.create(name="Test Dataset", gbif_dataset_key="abc-123")
+    with pytest.raises(DatabaseError, match="cannot be changed") as exc_info:
+        Dataset.objects.filter(pk=dataset.pk).update(gbif_dataset_key="changed")
+    assert exc_info.value.__cause__.pgcode == DATASET_KEY_CHANGE_SQLSTATE
@@ -89,3 +89,17 @@ def test_stable_id_unchanged_when_gbif_id_changes(species):
     obs.refresh_from_db()
 
     assert obs.stable_id == original_stable_id
+
+
+@pytest.mark.django_db
+def test_bulk_create_sets_source_dataset_gbif_key(species):
+    """The denormalized field is set by a database trigger, so bulk_create() doesn't need to provide it"""
+    dataset = Dataset.objects.create(name="Test Dataset", gbif_dataset_key="abc-123")
+    Observation.objects.bulk_create([
+        Observation(gbif_id="gbif-1", occurrence_id="occ-1", source_dataset=dataset, species=species, date=date(2024, 1, 15)),
+        Observation(gbif_id="gbif-2", occurrence_id="occ-2", source_dataset=dataset, species=species, date=date(2024, 1, 15)),
+    ])
+
+    observations = Observation.objects.order_by("gbif_id")
+    assert [obs.source_dataset_gbif_key for obs in observations] == ["abc-123", "abc-123"]
+    assert all(obs.stable_id is not None for obs in observations)
@@ -1,17 +1,19 @@
 import csv
 import io
-import tempfile
 import zipfile
 from datetime import date
+from uuid import uuid4
 
 import pytest
 from django.core.management import call_command
+from django.db import connection
 
+from alerts.management.commands.import_observations import ReadAheadReader
 from alerts.models import Dataset, Observation, Species
 
 
-def create_test_zip(rows, header=None):
-    """Create a temporary DwC-A zip file with the given rows."""
+def create_test_zip(directory, row_iter, header=None, compression=zipfile.ZIP_STORED):
+    """Create a DwC-A zip file in directory with the rows of the given iterable (consumed as it is written)."""
     if header is None:
         header = [
             "gbifID", "references", "datasetName", "basisOfRecord", "occurrenceID",
@@ -21,16 +23,18 @@ def create_test_zip(rows, header=None):
             "speciesKey", "species",
         ]
 
-    tmp = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
-    with zipfile.ZipFile(tmp.name, "w") as zf:
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter="\t")
-        writer.writerow(header)
-        for row in rows:
-            writer.writerow(row)
-        zf.writestr("occurrence.txt", output.getvalue())
+    path = directory / f"{uuid4().hex}.zip"
+    # Test archives are tiny and thrown away: no compression by default (the importer reads both kinds)
+    with zipfile.ZipFile(path, "w", compression=compression) as zf:
+        # Rows are written straight to the zip entry, like the importer reads them back
+        with zf.open("occurrence.txt", "w") as f:
+            with io.TextIOWrapper(f, encoding="utf-8", newline="") as output:
+                writer = csv.writer(output, delimiter="\t")
+                writer.writerow(header)
+                for row in row_iter:
+                    writer.writerow(row)
 
-    return tmp.name
+    return str(path)
 
 
 def make_row(
@@ -73,11 +77,38 @@ def make_row(
     ]
 
 
+def observation_table_definitions():
+    """Index and constraint definitions of the Observation table, as reported by PostgreSQL."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s ORDER BY indexname",
+            [Observation._meta.db_table],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid), condeferrable, condeferred
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass
+            ORDER BY conname
+            """,
+            [Observation._meta.db_table],
+        )
+        constraints = cursor.fetchall()
+    return indexes, constraints
+
+
+@pytest.fixture(scope="session")
+def zip_dir(tmp_path_factory):
+    """A directory for the test archives, shared by the whole session and cleaned up by pytest."""
+    return tmp_path_factory.mktemp("dwca")
+
+
 @pytest.fixture
-def simple_zip():
+def simple_zip(zip_dir):
     """A zip file with a single valid row."""
     rows = [make_row()]
-    return create_test_zip(rows)
+    return create_test_zip(zip_dir, rows)
 
 
 @pytest.mark.django_db
@@ -97,13 +128,13 @@ class TestImportObservations:
         assert obs.species.scientific_name == "Vespa velutina"
         assert obs.source_dataset.gbif_dataset_key == "ds-key-1"
 
-    def test_imports_multiple_observations(self):
+    def test_imports_multiple_observations(self, zip_dir):
         rows = [
             make_row(gbif_id="1", occurrence_id="occ-1"),
             make_row(gbif_id="2", occurrence_id="occ-2"),
             make_row(gbif_id="3", occurrence_id="occ-3"),
         ]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
@@ -111,13 +142,13 @@ class TestImportObservations:
         assert Species.objects.count() == 1  # Same species for all
         assert Dataset.objects.count() == 1  # Same dataset for all
 
-    def test_creates_multiple_species(self):
+    def test_creates_multiple_species(self, zip_dir):
         rows = [
             make_row(gbif_id="1", species_key="100", species_name="Species A"),
             make_row(gbif_id="2", species_key="200", species_name="Species B"),
             make_row(gbif_id="3", species_key="300", species_name="Species C"),
         ]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
@@ -126,25 +157,25 @@ class TestImportObservations:
             "Species A", "Species B", "Species C"
         }
 
-    def test_creates_multiple_datasets(self):
+    def test_creates_multiple_datasets(self, zip_dir):
         rows = [
             make_row(gbif_id="1", dataset_key="ds-1", dataset_name="Dataset 1"),
             make_row(gbif_id="2", dataset_key="ds-2", dataset_name="Dataset 2"),
         ]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Dataset.objects.count() == 2
 
-    def test_reuses_existing_species(self):
+    def test_reuses_existing_species(self, zip_dir):
         Species.objects.create(
             gbif_taxon_key=12345,
             scientific_name="Existing Species",
             vernacular_name="",
         )
         rows = [make_row(species_key="12345", species_name="Vespa velutina")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
@@ -152,13 +183,13 @@ class TestImportObservations:
         # Name should be unchanged (existing species reused)
         assert Species.objects.first().scientific_name == "Existing Species"
 
-    def test_reuses_existing_dataset(self):
+    def test_reuses_existing_dataset(self, zip_dir):
         Dataset.objects.create(
             gbif_dataset_key="ds-key-1",
             name="Existing Dataset",
         )
         rows = [make_row(dataset_key="ds-key-1", dataset_name="New Name")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
@@ -166,11 +197,13 @@ class TestImportObservations:
         assert Dataset.objects.first().name == "Existing Dataset"
 
     @pytest.mark.django_db(transaction=True)
-    def test_truncates_observations_on_reimport(self):
+    def test_truncates_observations_on_full_refresh(self, zip_dir):
+        definitions = observation_table_definitions()
+
         # First import
         rows = [make_row(gbif_id="1")]
-        zip_path = create_test_zip(rows)
-        call_command("import_observations", zip_path)
+        zip_path = create_test_zip(zip_dir, rows)
+        call_command("import_observations", zip_path, "--full-refresh")
         assert Observation.objects.count() == 1
 
         # Second import with different data
@@ -178,77 +211,137 @@ class TestImportObservations:
             make_row(gbif_id="2", occurrence_id="occ-2"),
             make_row(gbif_id="3", occurrence_id="occ-3"),
         ]
-        zip_path = create_test_zip(rows)
-        call_command("import_observations", zip_path)
+        zip_path = create_test_zip(zip_dir, rows)
+        call_command("import_observations", zip_path, "--full-refresh")
 
         # Old observation should be gone, only new ones remain
         assert Observation.objects.count() == 2
         assert set(Observation.objects.values_list("gbif_id", flat=True)) == {"2", "3"}
+        # The dropped indexes (hash, GiST, composite) and deferred foreign keys are recreated identically
+        assert observation_table_definitions() == definitions
+
+    def test_reimport_only_applies_differences(self, zip_dir):
+        rows = [
+            make_row(gbif_id="1", occurrence_id="occ-1"),
+            make_row(gbif_id="2", occurrence_id="occ-2"),
+            make_row(gbif_id="3", occurrence_id="occ-3"),
+        ]
+        call_command("import_observations", create_test_zip(zip_dir, rows))
+        unchanged_pk = Observation.objects.get(gbif_id="1").pk
 
-    def test_skips_row_missing_species_key(self):
+        rows = [
+            make_row(gbif_id="1", occurrence_id="occ-1"),  # Unchanged
+            make_row(gbif_id="2", occurrence_id="occ-2", locality="Park"),  # Changed
+            make_row(gbif_id="4", occurrence_id="occ-4"),  # New (3 is gone)
+        ]
+        out = io.StringIO()
+        call_command("import_observations", create_test_zip(zip_dir, rows), stdout=out)
+
+        assert set(Observation.objects.values_list("gbif_id", flat=True)) == {"1", "2", "4"}
+        assert Observation.objects.get(gbif_id="1").pk == unchanged_pk
+        assert Observation.objects.get(gbif_id="2").locality == "Park"
+        assert "2 observations added or updated, 2 deleted (gone or replaced)" in out.getvalue()
+
+    def test_first_import_loads_as_full_refresh(self, zip_dir):
+        out = io.StringIO()
+        call_command("import_observations", create_test_zip(zip_dir, [make_row()]), stdout=out)
+        assert "loading it as a full refresh" in out.getvalue()
+
+        out = io.StringIO()
+        call_command("import_observations", create_test_zip(zip_dir, [make_row()]), stdout=out)
+        assert "loading it as a full refresh" not in out.getvalue()
+        assert Observation.objects.count() == 1
+
+    def test_imports_deflated_archive(self, zip_dir):
+        # GBIF downloads are deflated: the member is decompressed in the background thread of ReadAheadReader
+        rows = [make_row(gbif_id=str(i), occurrence_id=f"occ-{i}") for i in range(1000)]
+        zip_path = create_test_zip(zip_dir, rows, compression=zipfile.ZIP_DEFLATED)
+
+        call_command("import_observations", zip_path)
+
+        assert Observation.objects.count() == 1000
+
+    def test_skips_row_missing_species_key(self, zip_dir):
         rows = [
             make_row(gbif_id="1", species_key=""),  # Missing
             make_row(gbif_id="2", species_key="12345"),  # Valid
         ]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.count() == 1
         assert Observation.objects.first().gbif_id == "2"
 
-    def test_skips_row_missing_dataset_key(self):
+    def test_skips_row_missing_dataset_key(self, zip_dir):
         rows = [
             make_row(gbif_id="1", dataset_key=""),  # Missing
             make_row(gbif_id="2", dataset_key="ds-key-1"),  # Valid
         ]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.count() == 1
         assert Observation.objects.first().gbif_id == "2"
 
-    def test_skips_row_missing_date(self):
+    def test_skips_row_missing_date(self, zip_dir):
         rows = [
             make_row(gbif_id="1", event_date="", year="", month="", day=""),  # Missing
             make_row(gbif_id="2", event_date="2024-01-15"),  # Valid
         ]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.count() == 1
         assert Observation.objects.first().gbif_id == "2"
 
-    def test_parses_date_from_event_date(self):
+    def test_reports_skip_reasons_summary(self, zip_dir):
+        rows = [
+            make_row(gbif_id="1", species_key=""),
+            make_row(gbif_id="2", species_key=""),
+            make_row(gbif_id="3", dataset_key=""),
+            make_row(gbif_id="4"),
+        ]
+        zip_path = create_test_zip(zip_dir, rows)
+        out = io.StringIO()
+
+        call_command("import_observations", zip_path, stdout=out)
+
+        output = out.getvalue()
+        assert "1 imported, 3 skipped" in output
+        assert "Skipped 2 rows: missing speciesKey" in output
+        assert "Skipped 1 rows: missing datasetKey" in output
+
+    def test_parses_date_from_event_date(self, zip_dir):
         rows = [make_row(event_date="2023-06-15")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.first().date == date(2023, 6, 15)
 
-    def test_parses_date_range_takes_first(self):
+    def test_parses_date_range_takes_first(self, zip_dir):
         rows = [make_row(event_date="2023-06-15/2023-06-20")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.first().date == date(2023, 6, 15)
 
-    def test_parses_date_from_year_month_day_fallback(self):
+    def test_parses_date_from_year_month_day_fallback(self, zip_dir):
         rows = [make_row(event_date="", year="2022", month="3", day="10")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.first().date == date(2022, 3, 10)
 
-    def test_transforms_coordinates_to_mercator(self):
+    def test_transforms_coordinates_to_mercator(self, zip_dir):
         # WGS84 coordinates for Brussels
         rows = [make_row(lat="50.85", lon="4.35")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
@@ -259,15 +352,27 @@ class TestImportObservations:
         assert abs(obs.location.x) > 100000
         assert abs(obs.location.y) > 100000
 
-    def test_handles_missing_coordinates(self):
+    def test_handles_missing_coordinates(self, zip_dir):
         rows = [make_row(lat="", lon="")]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         assert Observation.objects.first().location is None
 
-    def test_imports_optional_fields(self):
+    def test_handles_coordinates_outside_mercator(self, zip_dir):
+        rows = [
+            make_row(gbif_id="1", occurrence_id="occ-1", lat="90", lon="4.0"),  # North pole
+            make_row(gbif_id="2", occurrence_id="occ-2", lat="51.0", lon="200"),  # Invalid longitude
+        ]
+        zip_path = create_test_zip(zip_dir, rows)
+
+        call_command("import_observations", zip_path)
+
+        assert Observation.objects.count() == 2
+        assert not Observation.objects.filter(location__isnull=False).exists()
+
+    def test_imports_optional_fields(self, zip_dir):
         rows = [make_row(
             individual_count="5",
             municipality="Brussels",
@@ -277,7 +382,7 @@ class TestImportObservations:
             coordinate_uncertainty="100.5",
             references="http://example.com",
         )]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
@@ -290,11 +395,62 @@ class TestImportObservations:
         assert obs.coordinate_uncertainty_in_meters == 100.5
         assert obs.references == "http://example.com"
 
-    def test_stable_id_is_computed(self):
+    def test_ignores_fields_beyond_header(self, zip_dir):
+        # No references and vernacularName columns: a trailing extra field must not be read as one of them
+        header = ["gbifID", "occurrenceID", "eventDate", "datasetKey", "speciesKey", "species"]
+        rows = [["1", "occ-1", "2024-01-15", "ds-key-1", "12345", "Vespa velutina", "extra"]]
+        zip_path = create_test_zip(zip_dir, rows, header=header)
+
+        call_command("import_observations", zip_path)
+
+        obs = Observation.objects.get()
+        assert obs.references == ""
+        assert obs.species.vernacular_name == ""
+        assert obs.species.scientific_name == "Vespa velutina"
+
+    def test_imports_text_with_copy_special_characters(self, zip_dir):
+        # Backslashes have a special meaning in the COPY format and must survive the import
+        rows = [make_row(locality="C:\\Park\\North", recorded_by="\\N")]
+        zip_path = create_test_zip(zip_dir, rows)
+
+        call_command("import_observations", zip_path)
+
+        obs = Observation.objects.first()
+        assert obs.locality == "C:\\Park\\North"
+        assert obs.recorded_by == "\\N"
+
+    def test_stable_id_is_computed(self, zip_dir):
         rows = [make_row()]
-        zip_path = create_test_zip(rows)
+        zip_path = create_test_zip(zip_dir, rows)
 
         call_command("import_observations", zip_path)
 
         obs = Observation.objects.first()
         assert obs.stable_id is not None
+
+
+class FailingSource:
+    """File-like object returning a few chunks, then raising."""
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def read(self, size):
+        if not self._chunks:
+            raise OSError("read failed")
+        return self._chunks.pop(0)
+
+
+class TestReadAheadReader:
+    def test_reads_whole_source(self):
+        with ReadAheadReader(io.BytesIO(b"abcdefghij"), chunk_size=3, chunks_ahead=1) as reader:
+            assert reader.read() == b"abcdefghij"
+
+    def test_source_error_reaches_caller(self):
+        with ReadAheadReader(FailingSource([b"abc", b"def"]), chunk_size=3) as reader:
+            assert reader.read(6) == b"abc"
+            assert reader.read(3) == b"def"
+            with pytest.raises(OSError, match="read failed"):
+                reader.read(3)
+            # The reader is done, later reads don't block
+            assert reader.read(3) == b""
@@ -41,15 +41,14 @@ def dataset2(db):
 
 
 def create_observation(species, dataset, gbif_id, occurrence_id, obs_date=None):
-    obs = Observation.objects.create(
+    # No refresh_from_db() needed: generated fields (stable_id) are returned by the INSERT itself
+    return Observation.objects.create(
         gbif_id=gbif_id,
         occurrence_id=occurrence_id,
         source_dataset=dataset,
         species=species,
         date=obs_date or date.today(),  # Use today to avoid auto-mark-as-seen
     )
-    obs.refresh_from_db()
-    return obs
 
 
 @pytest.mark.django_db
@@ -149,6 +148,25 @@ class TestSyncAlertsCommand:
         alert.refresh_from_db()
         assert alert.unseen_count == 0
 
+    def test_removes_observations_no_longer_matching_filters(self, user, species, species2, dataset):
+        alert = Alert.objects.create(user=user, name="Test Alert")
+        alert.species.add(species)
+        create_observation(species, dataset, "1", "occ-1")
+        obs2 = create_observation(species2, dataset, "2", "occ-2")
+
+        call_command("sync_alerts")
+        assert AlertObservation.objects.filter(alert=alert).count() == 1
+
+        # The user switches the alert to the other species
+        alert.species.set([species2])
+
+        call_command("sync_alerts")
+        assert list(AlertObservation.objects.filter(alert=alert).values_list("stable_id", flat=True)) == [
+            obs2.stable_id
+        ]
+        alert.refresh_from_db()
+        assert alert.unseen_count == 1
+
     def test_auto_marks_old_observations_as_seen(self, user, species, dataset):
         alert = Alert.objects.create(
             user=user, name="Test Alert", auto_mark_seen_after_days=30